@@ -17,9 +17,10 @@ O que faz:
 Precisa ter:
 - Python 3.10+
 - playwright>=1.46
+- orjson (opcional, acelera salvar/ler os JSONs)
 
 Setup rápido:
-    pip install playwright
+    pip install playwright orjson
     playwright install
     playwright install msedge  # se for usar Edge
 
@@ -40,16 +41,22 @@ Comandos no prompt interativo:
     quit           -> sai
 
 Cria do lado do script:
-    ./JSONs  -> onde ficam os JSONs salvos
-    ./logs   -> logs de auditoria
+    ./JSONs    -> onde ficam os JSONs salvos
+    ./logs     -> logs de auditoria
+    ./profile  -> perfil do navegador reaproveitado entre execuções (cookies/sessão do login ficam aqui)
 
 Segurança:
-- O destaque visual só injeta overlay temporário via JS, não mexe no site.
+- O destaque visual é um overlay temporário via JS. Pra isso todo documento aberto no contexto
+  (inclusive páginas de login de terceiros) ganha window.__rpaHighlight / window.__rpaClearHighlight.
+- O scan deixa window.__rpaMapperScan (referências aos nós encontrados) em cada frame varrido; é
+  sobrescrito no próximo scan e some ao navegar/recarregar ou fechar o mapper.
 - Não salva conteúdo sensível, só metadata do elemento.
 """
 
 from __future__ import annotations
 import argparse
+import asyncio
+import atexit
 import json
 import os
 import re
@@ -58,11 +65,18 @@ import time
 import uuid
 import socket
 import getpass
+import threading
+import weakref
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, TextIO, Tuple
 
-from playwright.sync_api import sync_playwright, Page, Browser, BrowserContext, Frame, ElementHandle, TimeoutError as PWTimeoutError
+try:
+    import orjson  # opcional: dump/load de JSON bem mais rápido; sem ele cai no json da stdlib
+except ImportError:
+    orjson = None
+
+from playwright.async_api import async_playwright, Page, BrowserContext, Frame, ElementHandle, JSHandle, Error as PWError, TimeoutError as PWTimeoutError
 
 # ------------------------------ Utilidades ------------------------------
 
@@ -75,71 +89,89 @@ LOG_DIR.mkdir(exist_ok=True)
 SESSION_ID = uuid.uuid4().hex[:8]
 LOG_FILE = LOG_DIR / f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{SESSION_ID}.txt"
 
+# Arquivo de log fica aberto a sessão toda (buffer de 64 KiB) em vez de abrir/fechar a cada linha.
+# Uma thread daemon dá flush periódico pra trilha de auditoria não ficar parada no buffer.
+LOG_BUFFER_SIZE = 64 * 1024
+LOG_FLUSH_INTERVAL_S = 1.0
+
+_log_fh: Optional[TextIO] = None
+_log_lock = threading.Lock()
+
+def _log_flush_loop(fh: TextIO) -> None:
+    while True:
+        time.sleep(LOG_FLUSH_INTERVAL_S)
+        with _log_lock:
+            if fh.closed:
+                return
+            fh.flush()
+
+def _log_close() -> None:
+    with _log_lock:
+        if _log_fh is not None:
+            _log_fh.close()
+
+def _log_file() -> TextIO:
+    global _log_fh
+    if _log_fh is None:
+        _log_fh = open(LOG_FILE, "a", encoding="utf-8", buffering=LOG_BUFFER_SIZE)
+        atexit.register(_log_close)
+        threading.Thread(target=_log_flush_loop, args=(_log_fh,), name="log-flush", daemon=True).start()
+    return _log_fh
+
 def log(msg: str) -> None:
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{timestamp}] {msg}"
     print(line)
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
+    with _log_lock:
+        fh = _log_file()
+        if not fh.closed:
+            fh.write(line + "\n")
 
 # ------------------------------ Seletor ------------------------------
 
-CLICKABLE_CSS = ",".join([
-    # Botões/links 
-    "button",
-    "[role=button]",
-    "a[href]",
-    "input[type=button]",
-    "input[type=submit]",
-
-    # Campos editáveis
-    "input[type=text]",
-    "input[type=password]",
-    "input[type=search]",
-    "input[type=email]",
-    "input[type=tel]",
-    "input[type=number]",
-    "input[type=url]",
-    "input:not([type])",  # sem type -> geralmente text
-    "textarea",
-    "select",
-    "[contenteditable=''], [contenteditable='true']",
-    "[role=textbox]",
-    "[role=searchbox]",
-    "[role=combobox]",
-
-    # Heurísticas gerais 
-    "[onclick]",
-    "[tabindex]:not([tabindex='-1'])",
-])
-
 STABLE_ATTRS = [
     "data-testid", "data-test", "data-qa", "data-id", "data-cy", "data-e2e",
 ]
 
+# Regex compiladas uma vez (rodam por elemento / por nome salvo)
+_ID_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_\-:.]{2,}$")
+_SANITIZE_RE = re.compile(r"[^A-Za-z0-9_\-]")
+_CSS_ESCAPE_RE = re.compile(r"([^A-Za-z0-9_-])")
+
+# Tabelas da classificação/score (montadas uma vez, não por elemento)
+_KIND_BY_TAG = {"textarea": "textarea", "select": "select"}
+_BTNLIKE_INPUT_TYPES = frozenset({"button", "submit"})
+_SCORED_TAGS = frozenset({"button", "a", "input"})
+
 class SelectorPack(Dict[str, Any]):
     pass
 
 # ------------------------------ Controller ------------------------------
 
+# Perfil reaproveitado entre execuções (um por navegador: perfis de Edge/Chrome não são intercambiáveis)
+PROFILE_DIR = ROOT / "profile"
+BROWSER_CHANNELS = {"edge": "msedge", "chrome": "chrome"}
+
 class BrowserController:
     def __init__(self, browser_choice: str = "edge"):
         self.browser_choice = browser_choice
         self.p = None
-        self.browser: Optional[Browser] = None
         self.ctx: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
-
-    def __enter__(self):
-        self.p = sync_playwright().start()
-        if self.browser_choice == "edge":
-            self.browser = self.p.chromium.launch(channel="msedge", headless=False)
-        elif self.browser_choice == "chrome":
-            self.browser = self.p.chromium.launch(channel="chrome", headless=False)
-        else:
-            self.browser = self.p.chromium.launch(headless=False)
-        self.ctx = self.browser.new_context()
-        self.page = self.ctx.new_page()
+        # frame_path -> Frame resolvido; vale até alguma navegação/attach/detach de frame
+        self._frame_cache: Dict[Tuple[str, ...], Page | Frame] = {}
+
+    async def __aenter__(self):
+        self.p = await async_playwright().start()
+        # Contexto persistente: a partir da 2ª execução o perfil já existe e o cold start cai bastante
+        self.ctx = await self.p.chromium.launch_persistent_context(
+            user_data_dir=str(PROFILE_DIR / self.browser_choice),
+            channel=BROWSER_CHANNELS.get(self.browser_choice),
+            headless=False,
+        )
+        self.page = self.ctx.pages[0] if self.ctx.pages else await self.ctx.new_page()
+        for event in ("framenavigated", "frameattached", "framedetached"):
+            self.page.on(event, lambda _: self._frame_cache.clear())
         self._log_env()
         return self
 
@@ -148,78 +180,106 @@ class BrowserController:
         host = socket.gethostname()
         log(f"ENV user={uname} host={host} session={SESSION_ID} browser={self.browser_choice}")
 
-    def __exit__(self, exc_type, exc, tb):
+    async def __aexit__(self, exc_type, exc, tb):
         try:
             if self.ctx:
-                self.ctx.close()
-            if self.browser:
-                self.browser.close()
+                await self.ctx.close()
         finally:
             if self.p:
-                self.p.stop()
+                await self.p.stop()
 
-    def open(self, url: str):
+    async def open(self, url: str):
         assert self.page is not None
         log(f"OPEN {url}")
-        self.page.goto(url, wait_until="load", timeout=120_000)
+        await self.page.goto(url, wait_until="load", timeout=120_000)
 
     def current_url(self) -> str:
         return self.page.url if self.page else ""
 
+    def resolve_frame(self, frame_path: List[str]) -> Page | Frame:
+        key = tuple(frame_path)
+        target = self._frame_cache.get(key)
+        if target is None:
+            target = self._resolve_and_cache(key)
+        return target
+
+    def _resolve_and_cache(self, key: Tuple[str, ...]) -> Page | Frame:
+        # Busca cada nó pelo nome/url; se não achar, fica no frame atual
+        target: Page | Frame = self.page
+        for node in key:
+            found = None
+            for fr in (target.frames if isinstance(target, Page) else target.child_frames):
+                if fr.name == node or fr.url == node:
+                    found = fr
+                    break
+            target = found or target
+        self._frame_cache[key] = target
+        return target
+
 # ------------------------------ Coleta ------------------------------
 
 class ElementRecord:
-    def __init__(self, frame_path: List[str], handle: ElementHandle, index_in_scan: int):
+    def __init__(self, frame_path: List[str], index_in_scan: int, container: Page | Frame, slot: int):
         self.frame_path = frame_path
-        self.handle = handle
         self.index = index_in_scan
+        # O handle só é buscado quando precisa (highlight), pelo slot no registro do frame
+        self.container = container
+        self.slot = slot
         self.meta: Dict[str, Any] = {}
+        # (y, x) do bbox, montado uma vez no apply_raw pra ordenação do scan
+        self.sort_key: Tuple[float, float] = (0, 0)
 
-    def enrich(self, page_like: Page | Frame):
-        el = self.handle
+    async def get_handle(self) -> Optional[ElementHandle]:
+        # Sem cache: depois de navegar/recarregar um handle guardado estaria morto; o lookup é 1 round-trip.
+        # None = registro do scan não existe mais (documento novo ou frame removido)
         try:
-            el.scroll_into_view_if_needed(timeout=5_000)
-        except PWTimeoutError:
-            pass
-
-        bbox = el.bounding_box() or {"x": None, "y": None, "width": None, "height": None}
-        tag = el.evaluate("e=>e.tagName.toLowerCase()")
-        id_ = el.get_attribute("id")
-        cls = el.get_attribute("class")
-        role_attr = el.get_attribute("role")
-        aria_label = el.get_attribute("aria-label")
-        text = el.evaluate("e=> (e.innerText||'').trim().slice(0,200)")
-        title = el.get_attribute("title")
-        href = el.get_attribute("href")
-        type_ = el.get_attribute("type")
+            js_handle = await self.container.evaluate_handle(JS_SCAN_LOOKUP, self.slot)
+        except PWError:
+            gone = self.container.is_detached() if isinstance(self.container, Frame) else self.container.is_closed()
+            if gone:
+                return None
+            raise
+        return js_handle.as_element()
+
+    def apply_raw(self, raw: Dict[str, Any], offset: Tuple[float, float] = (0, 0)):
+        # Monta self.meta a partir do dict cru de cada elemento devolvido pelo JS_SCAN
+        # bbox do JS é relativo ao frame; offset (x, y) do iframe leva pro viewport da página principal
+        box = dict(raw["bbox"])
+        box["x"] += offset[0]
+        box["y"] += offset[1]
+        # Pixel CSS inteiro basta pra localizar/ordenar; deixa o JSON menor
+        bbox = {k: (int(round(v)) if isinstance(v, (int, float)) else v) for k, v in box.items()}
+        self.sort_key = (bbox.get("y") or 0, bbox.get("x") or 0)
+        tag = raw["tag"]
+        id_ = raw["id"]
+        cls = raw["cls"]
+        role_attr = raw["role"]
+        aria_label = raw["ariaLabel"]
+        text = raw["text"]
+        title = raw["title"]
+        href = raw["href"]
+        type_ = raw["type"]
 
         # Campos relevantes pra inputs/textarea/select/contenteditable
-        placeholder = el.get_attribute("placeholder")
-        name_attr   = el.get_attribute("name")
-        autocomplete = el.get_attribute("autocomplete")
-        readonly = el.get_attribute("readonly") is not None
-        required = el.get_attribute("required") is not None
-        aria_disabled = (el.get_attribute("aria-disabled") == "true")
-        inputmode = el.get_attribute("inputmode")
-        maxlength = el.get_attribute("maxlength")
-        contenteditable_attr = el.get_attribute("contenteditable")
+        placeholder = raw["placeholder"]
+        name_attr   = raw["name"]
+        autocomplete = raw["autocomplete"]
+        readonly = raw["readonly"]
+        required = raw["required"]
+        aria_disabled = raw["ariaDisabled"]
+        inputmode = raw["inputmode"]
+        maxlength = raw["maxlength"]
+        contenteditable_attr = raw["contenteditable"]
         is_contenteditable = (contenteditable_attr == "" or contenteditable_attr == "true")
 
         # NÃO gravar valor real por segurança/compliance; só comprimento (0 se não aplicável)
-        try:
-            value_length = el.evaluate("e=> (e.value !== undefined ? String(e.value).length : 0)")
-        except Exception:
-            value_length = 0
+        value_length = raw["valueLength"]
 
         # Atributos estáveis
-        attrs = {}
-        for a in STABLE_ATTRS:
-            val = el.get_attribute(a)
-            if val:
-                attrs[a] = val
+        attrs = raw["stable"]
 
-        css = generate_css_selector(page_like, el)
-        xpath = generate_xpath(page_like, el)
+        css = raw["css"]
+        xpath = raw["xpath"]
 
         # Inferência de role/name com conhecimento de input/textarea/select
         role_name = infer_role_name(tag, role_attr, aria_label, text, type_)
@@ -231,18 +291,13 @@ class ElementRecord:
         # Classificação do campo (pra listagem e JSON)
         if is_contenteditable:
             field_kind = "contenteditable"
-        elif tag == "textarea":
-            field_kind = "textarea"
-        elif tag == "select" or role_name.get("role") == "combobox":
+        elif tag in _KIND_BY_TAG:
+            field_kind = _KIND_BY_TAG[tag]
+        elif role_name.get("role") == "combobox":
             field_kind = "select"
         elif tag == "input":
             t = (type_ or "text").lower()
-            if t in {"text","password","search","email","tel","number","url"}:
-                field_kind = f"input:{t}"
-            elif t in {"button","submit"}:
-                field_kind = "input:button"
-            else:
-                field_kind = f"input:{t}"
+            field_kind = "input:button" if t in _BTNLIKE_INPUT_TYPES else f"input:{t}"
         else:
             field_kind = "other"
 
@@ -285,8 +340,8 @@ class ElementRecord:
             # Aria extra útil de debugging
             "aria": {
                 "label": aria_label,
-                "labelledby": el.get_attribute("aria-labelledby"),
-                "describedby": el.get_attribute("aria-describedby"),
+                "labelledby": raw["labelledby"],
+                "describedby": raw["describedby"],
             },
         }
         return self
@@ -313,7 +368,7 @@ def infer_role_name(tag: str, role: Optional[str], aria_label: Optional[str], te
             r = "button"
 
     # Nome: prioriza aria-label, depois placeholder, depois texto
-    # Aqui só decide entre aria e texto; placeholder entra no enrich e volta pelo dict
+    # Aqui só decide entre aria e texto; placeholder entra no apply_raw e volta pelo dict
     name = aria_label or (text if text else None)
     return {"role": r, "name": name}
 
@@ -322,10 +377,10 @@ def score_selector(id_: Optional[str], stable_attrs: Dict[str, str], role_name:
     score = 0
     if role_name.get("role") and role_name.get("name"):
         score += 40
-    if id_ and re.match(r"^[A-Za-z_][A-Za-z0-9_\-:.]{2,}$", id_):
+    if id_ and _ID_RE.match(id_):
         score += 40
     score += min(len(stable_attrs) * 10, 30)
-    if tag in {"button", "a", "input"}:
+    if tag in _SCORED_TAGS:
         score += 10
     return score
 
@@ -333,108 +388,248 @@ def score_selector(id_: Optional[str], stable_attrs: Dict[str, str], role_name:
 def walk_frames(root: Page | Frame, path: Optional[List[str]] = None) -> List[Tuple[List[str], Frame]]:
     path = path or []
     frames: List[Tuple[List[str], Frame]] = []
-    for fr in root.frames if isinstance(root, Page) else root.child_frames:
+    # page.frames já inclui o main frame e todos os netos: começa pelos filhos diretos pra não duplicar
+    for fr in root.main_frame.child_frames if isinstance(root, Page) else root.child_frames:
         name = fr.name or fr.url or "<anonymous>"
         frames.append((path + [name], fr))
         frames.extend(walk_frames(fr, path + [name]))
     return frames
 
 
-def collect_clickables(page: Page) -> List[ElementRecord]:
+# Quantos frames varrer em paralelo sem afogar o socket do CDP
+FRAME_SCAN_CONCURRENCY = 8
+
+async def collect_clickables(page: Page) -> List[ElementRecord]:
     records: List[ElementRecord] = []
+    sem = asyncio.Semaphore(FRAME_SCAN_CONCURRENCY)
+
+    async def collect_in(container: Page | Frame) -> Tuple[List[Dict[str, Any]], Tuple[float, float]]:
+        # Uma chamada por frame: varre, filtra (visível/não-desabilitado) e monta metadados no browser
+        async with sem:
+            raws = await call_js_function(container, JS_SCAN, {"stableAttrs": STABLE_ATTRS})
+            offset = (0, 0)
+            if isinstance(container, Frame) and container.parent_frame is not None:
+                # +1 round-trip por iframe: posição dele no viewport principal (já soma iframes aninhados)
+                box = await (await container.frame_element()).bounding_box()
+                if box:
+                    offset = (box["x"], box["y"])
+            return raws, offset
+
+    # Página + todos os frames descendentes, em paralelo
+    targets: List[Tuple[List[str], Page | Frame]] = [([], page), *walk_frames(page)]
+    results = await asyncio.gather(*(collect_in(fr) for _, fr in targets), return_exceptions=True)
+    # Índices atribuídos na ordem dos frames, igual ao scan sequencial
     index = 0
-
-    def collect_in(container: Page | Frame, frame_path: List[str]):
-        nonlocal index
-        handles = container.query_selector_all(CLICKABLE_CSS)
-        # Filtro JS para elementos realmente clicáveis e visíveis
-        filtered: List[ElementHandle] = []
-        for h in handles:
-            try:
-                visible = h.is_visible()
-            except Exception:
-                visible = False
-            if not visible:
-                continue
-            disabled = h.evaluate("e => e.disabled === true || e.hasAttribute('disabled') || e.getAttribute('aria-disabled') === 'true'")
-            if disabled:
-                continue
-            filtered.append(h)
-        for h in filtered:
-            rec = ElementRecord(frame_path, h, index)
-            rec.enrich(container)
+    for (path, container), result in zip(targets, results):
+        if isinstance(result, BaseException):
+            if not path:
+                raise result
+            log(f"WARN frame_collect path_len={len(path)} err={result}")
+            continue
+        raws, offset = result
+        for raw in raws:
+            rec = ElementRecord(path, index, container, raw["slot"])
+            rec.apply_raw(raw, offset)
             records.append(rec)
             index += 1
-
-    collect_in(page, [])
-    # Todos os frames descendentes
-    for path, fr in walk_frames(page):
-        try:
-            collect_in(fr, path)
-        except Exception as e:
-            log(f"WARN frame_collect path_len={len(path)} err={e}")
-    # Ordena por Y, depois X para passeio intuitivo
-    records.sort(key=lambda r: (r.meta.get("bbox", {}).get("y") or 0, r.meta.get("bbox", {}).get("x") or 0))
+    # Ordena por Y, depois X (já no viewport principal, iframes inclusos) para passeio intuitivo
+    records.sort(key=lambda r: r.sort_key)
     return records
 
 # ------------------------------ Geradores: Make by GPT ------------------------------
 
-JS_CSS_SELECTOR = """
-(e)=>{
-  function cssPath(el){
-    if (!(el instanceof Element)) return '';
+# Funções JS do scan: montadas no JS_SCAN abaixo
+
+# Critério de elegibilidade do scan (única fonte: o README aponta pra cá), testado direto
+# no nó dentro do TreeWalker (tag primeiro, atributos depois).
+_JS_CLICKABLE_FN = """
+  const INPUT_TYPES = new Set(['button','submit','text','password','search','email','tel','number','url']);
+  const ROLES = new Set(['button','textbox','searchbox','combobox']);
+  function isClickable(e){
+    const t = e.localName;
+    if (t === 'button' || t === 'textarea' || t === 'select') return true;
+    if (t === 'a' && e.hasAttribute('href')) return true;
+    if (t === 'input'){
+      const type = e.getAttribute('type');
+      if (type === null || INPUT_TYPES.has(type.toLowerCase())) return true;
+    }
+    if (ROLES.has(e.getAttribute('role'))) return true;
+    const ce = e.getAttribute('contenteditable');
+    if (ce === '' || ce === 'true') return true;
+    if (e.hasAttribute('onclick')) return true;
+    const ti = e.getAttribute('tabindex');
+    return ti !== null && ti !== '-1';
+  }
+"""
+
+# Uma passada só pelo documento (TreeWalker) que separa os candidatos (isClickable) e guarda
+# a posição de cada elemento entre os irmãos de mesma tag. Com isso não tem querySelectorAll à parte
+# e o CSS/XPath de cada alvo sai em O(profundidade), sem recontar irmãos elemento por elemento.
+_JS_SCAN_TREE_FN = """
+  function scanTree(root){
+    const nth = new WeakMap();
+    const counts = new Map();
+    const found = [];
+    nth.set(root, 1);
+    const walker = document.createTreeWalker(root, NodeFilter.SHOW_ELEMENT);
+    let node;
+    while ((node = walker.nextNode())){
+      let c = counts.get(node.parentNode);
+      if (!c){ c = {}; counts.set(node.parentNode, c); }
+      const n = (c[node.nodeName] || 0) + 1;
+      c[node.nodeName] = n;
+      nth.set(node, n);
+      if (isClickable(node)) found.push(node);
+    }
+    return {nth, found};
+  }
+"""
+
+# XPath absoluto (/html[1]/body[1]/...), com os índices vindos do scanTree()
+_JS_XPATH_INDEXED_FN = """
+  function xpathIndexed(el, nth){
+    const parts=[];
+    while (el && el.nodeType===Node.ELEMENT_NODE){
+      parts.unshift(`${el.nodeName.toLowerCase()}[${nth.get(el) || 1}]`);
+      el = el.parentNode;
+    }
+    return '/' + parts.join('/');
+  }
+"""
+
+# Caminho CSS até o primeiro ancestral com id; nth-of-type (vindo do scanTree()) só quando não é o 1º da tag
+_JS_CSS_PATH_INDEXED_FN = """
+  function cssPathIndexed(el, nth){
     const path=[];
     while (el && el.nodeType===Node.ELEMENT_NODE){
       let selector = el.nodeName.toLowerCase();
-      if (el.id){ selector += '#' + CSS.escape(el.id); path.unshift(selector); break; }
-      else {
-        let sib = el, nth=1;
-        while (sib = sib.previousElementSibling){ if (sib.nodeName.toLowerCase()===selector) nth++; }
-        if (nth!==1){ selector += `:nth-of-type(${nth})`; }
-      }
+      if (el.id){ path.unshift(selector + '#' + CSS.escape(el.id)); break; }
+      const n = nth.get(el) || 1;
+      if (n!==1){ selector += `:nth-of-type(${n})`; }
       path.unshift(selector);
       el = el.parentElement;
     }
     return path.join('>');
   }
-  return cssPath(e);
-}
 """
 
-JS_XPATH = """
-(e)=>{
-  function xpath(el){
-    if (el && el.nodeType===Node.ELEMENT_NODE){
-      const parts=[];
-      while (el && el.nodeType===Node.ELEMENT_NODE){
-        let ix = 0;
-        let sib = el.previousSibling;
-        while(sib){ if (sib.nodeType===Node.ELEMENT_NODE && sib.nodeName===el.nodeName) ix++; sib = sib.previousSibling; }
-        const tag = el.nodeName.toLowerCase();
-        const seg = `${tag}[${ix+1}]`;
-        parts.unshift(seg);
-        el = el.parentNode;
-      }
-      return '/' + parts.join('/');
-    }
-    return '';
+# Pacote de metadados do elemento, junto do scan (nada de get_attribute por elemento).
+# Usa getAttribute (e não e.type/e.href/...) pra manter os valores crus dos atributos.
+_JS_META_FN = """
+  function elementMeta(e, stableAttrs, r){
+    const attr = (k) => e.getAttribute(k);
+    const stable = {};
+    for (const k of stableAttrs){ const v = attr(k); if (v) stable[k] = v; }
+    return {
+      tag: e.tagName.toLowerCase(),
+      id: attr('id'),
+      cls: attr('class'),
+      role: attr('role'),
+      ariaLabel: attr('aria-label'),
+      text: (e.innerText||'').trim().slice(0,200),
+      title: attr('title'),
+      href: attr('href'),
+      type: attr('type'),
+      placeholder: attr('placeholder'),
+      name: attr('name'),
+      autocomplete: attr('autocomplete'),
+      readonly: e.hasAttribute('readonly'),
+      required: e.hasAttribute('required'),
+      ariaDisabled: attr('aria-disabled') === 'true',
+      inputmode: attr('inputmode'),
+      maxlength: attr('maxlength'),
+      contenteditable: attr('contenteditable'),
+      valueLength: (e.value !== undefined && e.value !== null ? String(e.value).length : 0),
+      stable: stable,
+      labelledby: attr('aria-labelledby'),
+      describedby: attr('aria-describedby'),
+      bbox: {x: r.x, y: r.y, width: r.width, height: r.height},
+    };
   }
-  return xpath(e);
-}
 """
 
-def generate_css_selector(node_context: Page | Frame, el: ElementHandle) -> str:
-    try:
-        return el.evaluate(JS_CSS_SELECTOR)
-    except Exception:
-        return ""
+# Filtro único do scan: não-desabilitado + visível (caixa não-vazia, sem visibility:hidden/display:none).
+# Recebe o rect já medido, que é reaproveitado no bbox; o getComputedStyle (mais caro) fica por último.
+_JS_CANDIDATE_FN = """
+  function isCandidate(e, r){
+    if (e.disabled === true || e.hasAttribute('disabled') || e.getAttribute('aria-disabled') === 'true') return false;
+    if (!(r.width > 0 && r.height > 0)) return false;
+    const cs = getComputedStyle(e);
+    return cs.visibility !== 'hidden' && cs.display !== 'none';
+  }
+"""
+
+# Scan inteiro de um frame numa chamada: varredura + filtro + metadados + seletores.
+# Os elementos ficam em window.__rpaMapperScan pra virar ElementHandle só quando preciso (sem mexer no DOM).
+JS_SCAN = ("({stableAttrs})=>{" + _JS_CLICKABLE_FN + _JS_SCAN_TREE_FN + _JS_CSS_PATH_INDEXED_FN + _JS_XPATH_INDEXED_FN
+           + _JS_META_FN + _JS_CANDIDATE_FN + """
+  const kept = [];
+  const out = [];
+  const {nth, found} = scanTree(document.documentElement);
+  for (const e of found){
+    const r = e.getBoundingClientRect();
+    if (!isCandidate(e, r)) continue;
+    const m = elementMeta(e, stableAttrs, r);
+    m.css = cssPathIndexed(e, nth);
+    m.xpath = xpathIndexed(e, nth);
+    m.slot = kept.length;
+    kept.push(e);
+    out.push(m);
+  }
+  window.__rpaMapperScan = kept;
+  return out;
+}""")
+
+JS_SCAN_LOOKUP = "(slot)=> (window.__rpaMapperScan || [])[slot] || null"
+
+# Fallbacks do test numa chamada só: primeiro candidato [query, 'css'|'xpath'] que achar algo, na ordem dada.
+# Seletor inválido só pula pro próximo. Cada XPath é compilado uma vez (XPathExpression) e fica no closure,
+# que vive enquanto o documento viver (a função é cacheada por frame via js_function).
+JS_RESOLVE_FIRST = """
+(()=>{
+  const xpaths = new Map();
+  function xpathFirst(query){
+    let expr = xpaths.get(query);
+    if (!expr){ expr = document.createExpression(query, null); xpaths.set(query, expr); }
+    return expr.evaluate(document, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+  }
+  return (candidates)=>{
+    for (const [query, kind] of candidates){
+      try {
+        const el = kind === 'css' ? document.querySelector(query) : xpathFirst(query);
+        if (el) return el;
+      } catch (e) {}
+    }
+    return null;
+  };
+})()
+"""
 
+# Cada frame compila as funções JS uma vez só (JSHandle); as chamadas seguintes só mandam a referência.
+# O handle morre junto com o documento (navegação): aí recompila e tenta de novo uma vez.
+_JS_FN_CACHE: "weakref.WeakKeyDictionary[Frame, Dict[str, JSHandle]]" = weakref.WeakKeyDictionary()
+
+async def js_function(node_context: Page | Frame, source: str, refresh: bool = False) -> JSHandle:
+    frame = node_context.main_frame if isinstance(node_context, Page) else node_context
+    fns = _JS_FN_CACHE.setdefault(frame, {})
+    fn = None if refresh else fns.get(source)
+    if fn is None:
+        fn = await frame.evaluate_handle(f"() => ({source})")
+        fns[source] = fn
+    return fn
+
+
+async def call_js_function(node_context: Page | Frame, source: str, arg: Any = None, as_handle: bool = False) -> Any:
+    for refresh in (False, True):
+        fn = await js_function(node_context, source, refresh)
+        try:
+            if as_handle:
+                return await node_context.evaluate_handle("([fn, arg]) => fn(arg)", [fn, arg])
+            return await node_context.evaluate("([fn, arg]) => fn(arg)", [fn, arg])
+        except PWError:
+            if refresh:
+                raise
 
-def generate_xpath(node_context: Page | Frame, el: ElementHandle) -> str:
-    try:
-        return el.evaluate(JS_XPATH)
-    except Exception:
-        return ""
 
 # ------------------------------ Highlighter ------------------------------
 
@@ -456,6 +651,10 @@ HIGHLIGHT_JS = """
   o.style.borderRadius='4px';
   o.style.boxShadow='0 0 8px rgba(30,144,255,0.7)';
   document.body.appendChild(o);
+  // Devolve se o alvo está inteiro na viewport (do próprio frame): aí não precisa rolar
+  const vw = window.innerWidth || document.documentElement.clientWidth;
+  const vh = window.innerHeight || document.documentElement.clientHeight;
+  return rect.top >= 0 && rect.left >= 0 && rect.bottom <= vh && rect.right <= vw;
 }
 """
 
@@ -463,59 +662,114 @@ REMOVE_HIGHLIGHT_JS = """
 ()=>{ const prev=document.getElementById('__rpa_mapper_overlay__'); if(prev) prev.remove(); }
 """
 
+# Instalado uma vez por documento (init script do contexto, vale pra iframes e navegações);
+# depois show/clear só mandam a chamada curta. Sem a função (doc anterior ao install) cai no JS inteiro.
+HIGHLIGHT_INSTALL_JS = (
+    "window.__rpaHighlight = " + HIGHLIGHT_JS.strip() + ";\n"
+    "window.__rpaClearHighlight = " + REMOVE_HIGHLIGHT_JS.strip() + ";\n"
+)
+HIGHLIGHT_CALL_JS = "(el)=> window.__rpaHighlight ? window.__rpaHighlight(el) : null"
+REMOVE_HIGHLIGHT_CALL_JS = "()=> window.__rpaClearHighlight ? (window.__rpaClearHighlight(), true) : false"
+
+# Espera máxima do scroll antes de pintar (elemento que não estabiliza não trava o walk)
+HIGHLIGHT_SCROLL_TIMEOUT_MS = 1_500
+
 class Highlighter:
     def __init__(self, controller: BrowserController):
         self.ctrl = controller
+        self.frame: Optional[Page | Frame] = None
 
-    def show(self, rec: ElementRecord):
-        # Navega para o frame correto e injeta overlay
+    async def install(self):
         page = self.ctrl.page
         if not page:
             return
-        target_frame = page
-        # Resolve frame path
-        for path_node in rec.frame_path:
-            # Busca pelo nome/url
-            found = None
-            for fr in (target_frame.frames if isinstance(target_frame, Page) else target_frame.child_frames):
-                if fr.name == path_node or fr.url == path_node:
-                    found = fr
-                    break
-            if not found:
-                # fallback: primeiro filho
-                if isinstance(target_frame, Page) and target_frame.frames:
-                    found = target_frame.frames[0]
-                elif hasattr(target_frame, 'child_frames') and target_frame.child_frames:
-                    found = target_frame.child_frames[0]
-            target_frame = found or target_frame
+        await page.context.add_init_script(script=HIGHLIGHT_INSTALL_JS)
+        # Documentos que já existem não passam pelo init script
+        for fr in page.frames:
+            try:
+                await fr.evaluate("()=>{" + HIGHLIGHT_INSTALL_JS + "}")
+            except Exception:
+                pass
+
+    async def show(self, rec: ElementRecord):
         try:
-            rec.handle.scroll_into_view_if_needed(timeout=5_000)
-            rec.handle.evaluate(HIGHLIGHT_JS)
+            handle = await rec.get_handle()
         except Exception as e:
             log(f"HIGHLIGHT error idx={rec.index} err={e}")
+            return
+        if handle is None:
+            # Registro do scan some quando a página navega/recarrega
+            log(f"HIGHLIGHT idx={rec.index}: elemento não está mais na página (navegou/recarregou?). Rode 'scan' de novo.")
+            return
+        await self.show_handle(handle, rec.frame_path, rec.index)
 
-    def clear(self):
+    async def show_handle(self, handle: ElementHandle, frame_path: List[str], index: int = -1):
+        # Só precisa do handle: scroll + overlay, sem montar metadados
+        page = self.ctrl.page
+        if not page:
+            return
+        # Guarda o frame (cache do controller) pro clear() tirar o overlay de dentro de iframe também
+        self.frame = self.ctrl.resolve_frame(frame_path)
+        try:
+            # Dentro de iframe a checagem de viewport só enxerga o próprio frame: rola sempre antes
+            if frame_path:
+                await self._scroll_into_view(handle)
+                await self._paint(handle)
+            # Main frame: pinta direto e só rola (e repinta) se o alvo estava fora da viewport
+            elif not await self._paint(handle):
+                await self._scroll_into_view(handle)
+                await self._paint(handle)
+        except Exception as e:
+            log(f"HIGHLIGHT error idx={index} err={e}")
+
+    async def _paint(self, handle: ElementHandle) -> bool:
+        in_viewport = await handle.evaluate(HIGHLIGHT_CALL_JS)
+        if in_viewport is None:
+            in_viewport = await handle.evaluate(HIGHLIGHT_JS)
+        return bool(in_viewport)
+
+    async def _scroll_into_view(self, handle: ElementHandle):
+        try:
+            await handle.scroll_into_view_if_needed(timeout=HIGHLIGHT_SCROLL_TIMEOUT_MS)
+        except PWTimeoutError:
+            pass
+
+    async def clear(self):
         page = self.ctrl.page
         if page:
-            try:
-                page.evaluate(REMOVE_HIGHLIGHT_JS)
-            except Exception:
-                pass
+            for target in {page, self.frame or page}:
+                try:
+                    if not await target.evaluate(REMOVE_HIGHLIGHT_CALL_JS):
+                        await target.evaluate(REMOVE_HIGHLIGHT_JS)
+                except Exception:
+                    pass
 
 # ------------------------------ Storage ------------------------------
 
+def drop_none(value: Any) -> Any:
+    # Tira campos None (recursivo em dicts/listas) pra enxugar o JSON salvo
+    if isinstance(value, dict):
+        return {k: drop_none(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [drop_none(v) for v in value]
+    return value
+
+
 class Storage:
     def __init__(self, base: Path):
         self.base = base
 
     def _dedup_name(self, name: str) -> Path:
-        sanitized = re.sub(r"[^A-Za-z0-9_\-]", "_", name)
-        candidate = self.base / f"{sanitized}.json"
+        sanitized = _SANITIZE_RE.sub("_", name)
+        # Lista o diretório uma vez e testa os nomes em memória (em vez de um stat por tentativa).
+        # casefold porque NTFS/APFS não diferenciam maiúsculas: Botao_Login.json == botao_login.json
+        existing = {p.name.casefold() for p in self.base.iterdir()}
+        candidate = f"{sanitized}.json"
         k = 2
-        while candidate.exists():
-            candidate = self.base / f"{sanitized}({k}).json"
+        while candidate.casefold() in existing:
+            candidate = f"{sanitized}({k}).json"
             k += 1
-        return candidate
+        return self.base / candidate
 
     def save_record(self, url: str, rec: ElementRecord, custom_name: str):
         path = self._dedup_name(custom_name)
@@ -527,18 +781,30 @@ class Storage:
             "session": SESSION_ID,
             "element": rec.meta,
         }
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
+        payload = drop_none(payload)
+        # "x": se o nome colidir mesmo assim, falha em vez de sobrescrever
+        if orjson is not None:
+            with open(path, "xb") as f:
+                f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        else:
+            with open(path, "x", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, indent=2)
         log(f"SAVED {path.name} idx={rec.index} url={url}")
         return path
 
     def load_record(self, filename: str) -> Dict[str, Any]:
         path = self.base / filename
+        if orjson is not None:
+            with open(path, "rb") as f:
+                return orjson.loads(f.read())
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
 
 # ------------------------------ CLI principal ------------------------------
 
+# Espera máxima do get_by_role no test (os seletores diretos não esperam)
+TEST_ROLE_TIMEOUT_MS = 1_000
+
 class RPAMapper:
     def __init__(self, browser_choice: str):
         self.browser_choice = browser_choice
@@ -546,14 +812,27 @@ class RPAMapper:
         self.highlighter = None
         self.records: List[ElementRecord] = []
         self.storage = Storage(JSON_DIR)
+        # Um loop só pra sessão inteira: os objetos do Playwright ficam presos ao loop que os criou
+        self.loop = asyncio.new_event_loop()
 
     def run(self):
         log("SESSION START")
-        with self.ctrl as ctrl:
-            self.highlighter = Highlighter(ctrl)
-            self.repl()
+        try:
+            ctrl = self._sync(self.ctrl.__aenter__())
+            try:
+                self.highlighter = Highlighter(ctrl)
+                self._sync(self.highlighter.install())
+                self.repl()
+            finally:
+                self._sync(self.ctrl.__aexit__(None, None, None))
+        finally:
+            self.loop.close()
         log("SESSION END")
 
+    def _sync(self, coro):
+        # REPL continua síncrono (input() bloqueante); cada comando roda até o fim no loop do Playwright
+        return self.loop.run_until_complete(coro)
+
     # -------------------------- Comandos --------------------------
     def repl(self):
         while True:
@@ -570,7 +849,7 @@ class RPAMapper:
             if op == "open" and len(parts) >= 2:
                 url = parts[1]
                 try:
-                    self.ctrl.open(url)
+                    self._sync(self.ctrl.open(url))
                 except Exception as e:
                     log(f"ERROR open url={url} err={e}")
 
@@ -581,7 +860,7 @@ class RPAMapper:
                 if not self.ctrl.page:
                     log("WARN no page")
                     continue
-                self.records = collect_clickables(self.ctrl.page)
+                self.records = self._sync(collect_clickables(self.ctrl.page))
                 log(f"SCAN found={len(self.records)}")
 
             elif op == "list":
@@ -606,11 +885,11 @@ class RPAMapper:
                 self.capture_by_index(idx)
 
             elif op == "test" and len(parts) >= 2:
-                self.test_saved(parts[1])
+                self._sync(self.test_saved(parts[1]))
 
             elif op == "reload":
                 try:
-                    self.ctrl.page.reload()
+                    self._sync(self.ctrl.page.reload())
                 except Exception as e:
                     log(f"ERROR reload err={e}")
 
@@ -632,7 +911,7 @@ class RPAMapper:
         log("WALK mode: N=next, P=prev, C=capture, S=skip, Q=quit")
         while True:
             rec = self.records[i]
-            self.highlighter.show(rec)
+            self._sync(self.highlighter.show(rec))
             print(f"idx={rec.index} tag={rec.meta.get('tag')} role={rec.meta.get('role')} text={rec.meta.get('text')!r} score={rec.meta.get('score')}")
             try:
                 k = input("[N/P/C/S/Q]> ").strip().lower()
@@ -647,7 +926,7 @@ class RPAMapper:
             elif k == 's':
                 i = min(i + 1, max_i)
             elif k == 'q':
-                self.highlighter.clear()
+                self._sync(self.highlighter.clear())
                 break
 
     def capture_record(self, rec: ElementRecord):
@@ -656,7 +935,11 @@ class RPAMapper:
             log("Capture cancelada: nome vazio.")
             return
         url = self.ctrl.current_url()
-        path = self.storage.save_record(url, rec, name)
+        try:
+            path = self.storage.save_record(url, rec, name)
+        except FileExistsError as e:
+            log(f"Capture cancelada: {e.filename} já existe, tente de novo.")
+            return
         print(f"Salvo: {path}")
 
     def capture_by_index(self, idx: int):
@@ -666,7 +949,7 @@ class RPAMapper:
             return
         self.capture_record(matches[0])
 
-    def test_saved(self, filename: str):
+    async def test_saved(self, filename: str):
         try:
             data = self.storage.load_record(filename)
         except FileNotFoundError:
@@ -695,39 +978,18 @@ class RPAMapper:
         stable = elem.get("stable_attrs") or {}
 
         # Resolve frame alvo primeiro
-        target: Page | Frame = page
         frame_path = elem.get("frame_path") or []
-        for node in frame_path:
-            found = None
-            for fr in (target.frames if isinstance(target, Page) else target.child_frames):
-                if fr.name == node or fr.url == node:
-                    found = fr
-                    break
-            target = found or target
+        target = self.ctrl.resolve_frame(frame_path)
 
-        # 1) Tentativa mais fiel: role + name (Playwright)
-        if role and name:
-            try:
-                handle = target.get_by_role(role, name=name).first.element_handle()
-                if handle:
-                    rec = ElementRecord(frame_path, handle, -1).enrich(target)
-                    self.highlighter.show(rec)
-                    log("TEST ok: destaque aplicado via role+name.")
-                    return
-            except Exception:
-                pass
-
-        # 2) Fallbacks em ordem de robustez
+        # 1) Seletores diretos em ordem de robustez (CSS/XPath resolvem bem mais rápido que role+name)
         name_attr = (elem.get("field") or {}).get("name")
         placeholder = (elem.get("field") or {}).get("placeholder")
 
         search_order: List[Tuple[str, str]] = []
-        if role:
-            search_order.append((f"[role='{css_escape(role)}']", "css"))
-        if id_:
-            search_order.append((f"#{css_escape(id_)}", "css"))
         for k, v in stable.items():
             search_order.append((f"[{k}='{css_escape(v)}']", "css"))
+        if id_:
+            search_order.append((f"#{css_escape(id_)}", "css"))
         if name_attr:
             search_order.append((f"[name='{css_escape(name_attr)}']", "css"))
         if placeholder:
@@ -737,30 +999,43 @@ class RPAMapper:
         if xpath:
             search_order.append((xpath, "xpath"))
 
+        # Todos os candidatos resolvidos numa chamada só, na ordem de prioridade (não espera o elemento aparecer)
         handle = None
-        for query, kind in search_order:
+        if search_order:
             try:
-                if kind == "css":
-                    handle = target.query_selector(query)
-                else:
-                    handle = target.locator(f"xpath={query}").element_handle()
-                if handle:
-                    break
+                handle = (await call_js_function(target, JS_RESOLVE_FIRST, search_order, as_handle=True)).as_element()
+            except Exception as e:
+                log(f"WARN test resolve err={e}")
+
+        # 2) Sem match direto: role + name (Playwright) como desempate semântico
+        if handle is None and role and name:
+            try:
+                handle = await target.get_by_role(role, name=name).first.element_handle(timeout=TEST_ROLE_TIMEOUT_MS)
             except Exception:
-                continue
+                handle = None
+            if handle:
+                await self.highlighter.show_handle(handle, frame_path)
+                log("TEST ok: destaque aplicado via role+name.")
+                return
+
+        # 3) Último recurso: só o role
+        if handle is None and role:
+            try:
+                handle = await target.query_selector(f"[role='{css_escape(role)}']")
+            except Exception:
+                handle = None
 
         if handle is None:
             log("Elemento não localizado pelos seletores salvos.")
             return
 
-        rec = ElementRecord(frame_path, handle, -1).enrich(target)
-        self.highlighter.show(rec)
+        await self.highlighter.show_handle(handle, frame_path)
         log("TEST ok: destaque aplicado.")
 
 # ------------------------------ Socorro Deus da vida ------------------------------
 
 def css_escape(s: str) -> str:
-    return re.sub(r"([^A-Za-z0-9_-])", lambda m: f"\\{m.group(1)}", s)
+    return _CSS_ESCAPE_RE.sub(r"\\\1", s)
 
 # ------------------------------ main ------------------------------
 